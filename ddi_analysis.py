@@ -0,0 +1,385 @@
+# --- DDI Analysis Engine ---
+# Prescription parsing and interaction detection, kept free of Streamlit so rows
+# can be analyzed in worker processes. FDA label texts are fetched by the app and
+# passed in as a plain {ingredient: text} dict.
+
+import re
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import combinations
+
+# --- DATABASE LOADING LOGIC ---
+def load_db_logic():
+    """Attempts to load external DB, falls back to Mock DB."""
+    try:
+        from structured_drug_db import get_drug_by_name, prime_drug_matches
+        return True, get_drug_by_name, prime_drug_matches
+    except ImportError:
+        # Simplified Fallback
+        return False, None, None
+
+is_external_db, get_drug_func, prime_drug_func = load_db_logic()
+
+def load_item_dtype():
+    """Arrow-backed strings when pyarrow is installed (split/explode stay in Arrow)."""
+    try:
+        import pyarrow as pa
+        return pd.ArrowDtype(pa.string())
+    except ImportError:
+        return None  # NumPy object strings
+
+item_dtype = load_item_dtype()
+
+# Field order of the alert tuples produced by analyze_row
+ALERT_COLUMNS = ('Prescription ID', 'Time Slot', 'Drug Pair', 'Warning', 'Severity')
+
+# --- PRECOMPILED PATTERNS ---
+# Compiled once at import so the per-item hot path skips the `re` cache lookup.
+# Structural noise that is not whitespace-delimited: fractions ("1/2"),
+# colon doses (":0.5") and hashes. Removed in a single pass.
+_RE_CLEAN = re.compile(r'\s*\d+/\d+|:[\d\.]+|[#]+')
+
+# Item delimiters inside one prescription cell (old ";" and new "|||" exports)
+_RE_ITEM_DELIMS = re.compile(r'\|\|\||[;\n]')
+
+# Whole-token noise (dosage forms, units, racikan shorthand) is filtered by set
+# membership instead of regex alternation.
+_NOISE_TOKENS = frozenset({
+    'SYR', 'TAB', 'SACHET', 'TABLET', 'KAPSUL', 'INJEKSI', 'MG', 'ML', 'CC', '*',
+    'ANS', 'DROPS', 'M.F.', 'PULV', 'DTD', 'NO.'
+})
+# Units that may also be glued to a dose number ("5ML", "500MG")
+_UNIT_TOKENS = frozenset({'MG', 'ML', 'CC'})
+# Punctuation ignored around a token when checking it ("TAB.", "(500)")
+_TOKEN_PUNCT = '.,;:()[]{}*'
+
+# Frequency ("3 dd" / "3x") and time-of-day keywords in one scan. The lookahead
+# makes every match zero-width, so overlapping hits are still all reported.
+_RE_SLOTS = re.compile(
+    r'(?=(?P<freq>[1-4])\s*(?:dd|x)'
+    r'|(?P<Night>malam|night|sore)'
+    r'|(?P<Morning>pagi|morning)'
+    r'|(?P<Noon>siang|noon))'
+)
+# "3 dd" wins over "2 dd", which wins over "4 dd", then "1 dd"
+_FREQ_PRIORITY = (3, 2, 4, 1)
+
+# Severity keywords, matched by one alternation. High keywords come first so they
+# win when both kinds could match at the same position.
+_HIGH_KEYWORDS = [
+    'contraindicated', 'avoid', 'fatal', 'life-threatening', 'severe', 'serious', 
+    'do not use', 'unsafe', 'anaphylaxis', 'hypoglycemia', 'hospitalization', 'death',
+    'toxicity', 'major interaction'
+]
+_MODERATE_KEYWORDS = [
+    'monitor', 'caution', 'risk', 'adjust', 'potential', 'care', 'consider',
+    'may increase', 'may decrease', 'alter', 'effect'
+]
+_RE_SEVERITY = re.compile(
+    '(?P<high>' + '|'.join(map(re.escape, _HIGH_KEYWORDS)) + ')'
+    '|(?P<moderate>' + '|'.join(map(re.escape, _MODERATE_KEYWORDS)) + ')'
+)
+
+@lru_cache(maxsize=4096)
+def _mention_pattern(target):
+    """Matches a mention of `target`, allowing suffixes (e.g. "NSAID" -> "NSAIDs")."""
+    return re.compile(r'\b' + re.escape(target) + r'[a-z]*\b', re.IGNORECASE)
+
+# --- HELPER FUNCTIONS ---
+
+def _is_dosage_number(token):
+    """True for short numeric tokens such as "10", "0.5", "0,5" or "1-0-0"."""
+    for part in token.split('-'):
+        whole, dot, frac = part.replace(',', '.').partition('.')
+        if dot and not frac.isdecimal():
+            return False
+        if not (whole.isdecimal() and len(whole) <= 3):
+            return False
+    return True
+
+def _is_noise_part(part):
+    """True for a noise word, a dosage number, or a dosage number glued to a unit."""
+    if part in _NOISE_TOKENS or _is_dosage_number(part):
+        return True
+    unit = part.lstrip('0123456789.,')
+    return unit in _UNIT_TOKENS and unit != part and _is_dosage_number(part[:-len(unit)])
+
+def _is_noise_token(token):
+    """
+    True for tokens that are only dosage forms, units or dose numbers, ignoring
+    surrounding punctuation. Unit tokens are checked per '/' part ("MG/5ML").
+    """
+    if token in _NOISE_TOKENS:
+        return True
+    core = token.strip(_TOKEN_PUNCT)
+    if not core:
+        return False
+    return all(_is_noise_part(part) for part in core.split('/') if part)
+
+@lru_cache(maxsize=65536)
+def clean_drug_name(raw_name):
+    """
+    Cleans a raw drug string, maps it to a canonical name, and filters out equipment.
+    UPDATED logic to handle ANS, dosage forms, and special characters.
+    """
+    if not isinstance(raw_name, str) or not raw_name.strip(): return None
+        
+    cleaned_name = raw_name.strip().upper()
+    
+    # 1. Handle Multiline (Racikan)
+    if '\n' in cleaned_name:
+        cleaned_name = cleaned_name.split('\n')[0]
+
+    # 2. Aggressive cleaning to isolate the base product name
+    cleaned_name = _RE_CLEAN.sub('', cleaned_name)
+    
+    # Drop noise words and dosage numbers (e.g., "10" or "0.5"), collapsing spaces
+    tokens = [t for t in cleaned_name.split() if not _is_noise_token(t)]
+    cleaned_name = ' '.join(tokens)
+    
+    return cleaned_name
+
+@lru_cache(maxsize=65536)
+def parse_time_slots(prescription_str):
+    s = prescription_str.lower()
+    slots = set()
+    freqs = set()
+    
+    for match in _RE_SLOTS.finditer(s):
+        if match.lastgroup == 'freq':
+            freqs.add(int(match.group('freq')))
+        else:
+            slots.add(match.lastgroup)
+
+    if not slots:
+        freq = next((n for n in _FREQ_PRIORITY if n in freqs), 1)
+        if freq >= 1: slots.add('Morning')
+        if freq >= 2: slots.add('Night')
+        if freq >= 3: slots.add('Noon')
+            
+    # Tuple so the cached result cannot be mutated by callers
+    return tuple(slots)
+
+def determine_severity(text):
+    """Parses FDA warning text to determine severity level."""
+    # Single pass over the text: stop at the first high keyword, remember moderate ones
+    severity = 'Low'
+    for match in _RE_SEVERITY.finditer(text.lower()):
+        if match.lastgroup == 'high':
+            return 'High'
+        severity = 'Moderate'
+    return severity
+
+@lru_cache(maxsize=512)
+def _lowered_label(text):
+    """Lowercased copy of a label text, computed once per label instead of per scan."""
+    return text.lower()
+
+def find_mentions(text, targets):
+    """
+    Returns {target: snippet} for every target the label text mentions, with the
+    snippet taken around its first mention (200 chars of context each side).
+    """
+    if not text or not targets: return {}
+    
+    # Cheap substring prefilter on the lowercased label: most labels mention none
+    # of the co-prescribed drugs, so the regex search is usually skipped entirely.
+    lowered = _lowered_label(text)
+    
+    found = {}
+    for t in targets:
+        if t.lower() not in lowered: continue
+        # Searched per target: in one combined alternation a longer name
+        # ("Insulin Glargine") would consume a shorter one it contains ("Insulin")
+        match = _mention_pattern(t).search(text)
+        if not match: continue
+        start = max(0, match.start() - 200)
+        end = min(len(text), match.end() + 200)
+        found[t] = "..." + text[start:end] + "..."
+    return found
+
+@lru_cache(maxsize=65536)
+def _ingredients_for(clean_name):
+    """Resolves a cleaned drug name to its active ingredients (empty tuple if unknown)."""
+    try:
+        drug_obj = get_drug_func(clean_name) if get_drug_func else None
+        if not drug_obj: return ()
+        raw_contents = getattr(drug_obj, 'contents', [])
+        ingredients_list = []
+        if isinstance(raw_contents, str):
+            ingredients_list = [x.strip() for x in raw_contents.split(',')]
+        elif isinstance(raw_contents, list):
+            ingredients_list = raw_contents
+        else:
+            ingredients_list = getattr(drug_obj, 'active_ingredients', [])
+        return tuple(x.strip() for x in ingredients_list if x.strip())
+    except Exception:
+        return ()
+
+def build_time_buckets(row_str):
+    """Groups the distinct active ingredients of one prescription row by time slot."""
+    # Normalize once: stripped items share cache entries across rows, and an
+    # item repeated within the row is only resolved once
+    items = dict.fromkeys(item.strip() for item in _RE_ITEM_DELIMS.split(row_str))
+    
+    time_buckets = {'Morning': set(), 'Noon': set(), 'Night': set()}
+    
+    for item in items:
+        if not item: continue
+        ingredients = _ingredients_for(clean_drug_name(item))
+        if ingredients:
+            for slot in parse_time_slots(item):
+                time_buckets[slot].update(ingredients)
+    return time_buckets
+
+def explode_items(prescriptions):
+    """
+    Splits a whole prescription column into one long Series of stripped items,
+    indexed by row position, with vectorized pandas string ops.
+    """
+    # Missing cells hold no items (analyze_rows skips them too); pandas 3 keeps
+    # them as NaN through astype(str)
+    rows = pd.Series(prescriptions, dtype=object).reset_index(drop=True).dropna().astype(str)
+    if item_dtype is not None:
+        # Arrow kernels split into list arrays and explode them without Python
+        # lists; they take literal delimiters only, so fold them into ';' first
+        rows = rows.astype(item_dtype).str.replace('|||', ';', regex=False).str.replace('\n', ';', regex=False)
+        items = rows.str.split(';').explode().str.strip()
+    else:
+        items = rows.str.split(_RE_ITEM_DELIMS).explode().str.strip()
+    return items[items != '']
+
+def collect_label_candidates(prescriptions):
+    """Returns every ingredient that shares a time slot with another one, i.e. needs an FDA label."""
+    items = explode_items(prescriptions)
+    
+    # Clean, resolve and slot each distinct item once, then expand to (row, slot, ingredient)
+    clean_names = {item: clean_drug_name(item) for item in items.unique()}
+    if prime_drug_func:
+        # Fuzzy-match every unknown name in one batch instead of one scan per name
+        prime_drug_func(set(clean_names.values()) - {None})
+    resolved = {
+        item: (_ingredients_for(name), parse_time_slots(item))
+        for item, name in clean_names.items()
+    }
+    records = [
+        (row, slot, ingredient)
+        for row, item in items.items()
+        for ingredient in resolved[item][0]
+        for slot in resolved[item][1]
+    ]
+    if not records: return set()
+    
+    long_df = pd.DataFrame(records, columns=['row', 'slot', 'ingredient']).drop_duplicates()
+    shared = long_df.groupby(['row', 'slot'])['ingredient'].transform('size') >= 2
+    return set(long_df.loc[shared, 'ingredient'])
+
+def _interacting_pairs(unique_ingredients, labels):
+    """
+    Returns (pair, warning, severity) for every pair of `unique_ingredients`
+    (sorted) where one drug's FDA label mentions the other.
+    """
+    # Scan each label once for every other drug in the slot, instead of once per pair.
+    # Drugs without label text cannot mention anything, so they are not scanned.
+    mentions = {
+        ing: find_mentions(
+            labels[ing],
+            tuple(x for x in unique_ingredients if x != ing)
+        )
+        for ing in unique_ingredients if labels.get(ing)
+    }
+    if not any(mentions.values()): return []
+    
+    pairs = []
+    for ing_a, ing_b in combinations(unique_ingredients, 2):
+        # A's label mentioning B wins over B's label mentioning A
+        desc = mentions.get(ing_a, {}).get(ing_b) or mentions.get(ing_b, {}).get(ing_a)
+        if desc:
+            pairs.append((f"{ing_a} + {ing_b}", desc, determine_severity(desc)))
+    return pairs
+
+def analyze_row(row_str, row_id, labels):
+    """
+    Returns the interaction alerts of one prescription row as tuples laid out
+    like ALERT_COLUMNS. `labels` maps each ingredient to its FDA label text
+    (see collect_label_candidates).
+    """
+    if not isinstance(row_str, str): return []
+    
+    time_buckets = build_time_buckets(row_str)
+
+    # Slots often hold the same drugs (e.g. "2 dd" fills Morning and Night), so
+    # each distinct ingredient set is checked once and its pairs reused.
+    pairs_by_set = {}
+    alerts = []
+    for slot, ingredients in time_buckets.items():
+        if len(ingredients) < 2: continue
+        unique_ingredients = tuple(sorted(ingredients))
+        if unique_ingredients not in pairs_by_set:
+            pairs_by_set[unique_ingredients] = _interacting_pairs(unique_ingredients, labels)
+        
+        for pair, desc, severity in pairs_by_set[unique_ingredients]:
+            alerts.append((row_id, slot, pair, desc, severity))
+    return alerts
+
+# --- PARALLEL DRIVER ---
+# Below this many rows the process pool costs more to start than it saves.
+PARALLEL_MIN_ROWS = 1000
+
+_worker_labels = {}
+
+def _init_worker(labels):
+    """Installs the prefetched label texts in a worker process."""
+    global _worker_labels
+    _worker_labels = labels
+
+def _analyze_row_safe(row_str, row_id, labels):
+    try:
+        return analyze_row(row_str, row_id, labels)
+    except Exception as e:
+        print(f"Row {row_id} failed: {e}")
+        return []
+
+def _analyze_row_task(row_str, row_id):
+    return _analyze_row_safe(row_str, row_id, _worker_labels)
+
+def _map_rows(row_strs, row_ids, labels, chunksize):
+    """Analyzes each row, in-process or over a process pool by input size."""
+    if len(row_strs) < PARALLEL_MIN_ROWS:
+        for row_str, row_id in zip(row_strs, row_ids):
+            yield _analyze_row_safe(row_str, row_id, labels)
+        return
+    
+    executor = ProcessPoolExecutor(initializer=_init_worker, initargs=(labels,))
+    try:
+        yield from executor.map(_analyze_row_task, row_strs, row_ids, chunksize=chunksize)
+    finally:
+        # Don't keep crunching queued chunks if the caller stops early (e.g. a Streamlit rerun)
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def analyze_rows(prescriptions, row_ids, labels, chunksize=64):
+    """
+    Yields the alerts of each row, in input order. Rows are independent and
+    CPU-bound once labels are prefetched, so large inputs are spread over a
+    process pool; small ones run in-process.
+    
+    Identical prescription strings are analyzed once and their alerts re-labelled
+    with each row's ID, since real exports repeat the same regimens many times.
+    """
+    keys = [row_str if isinstance(row_str, str) else None for row_str in prescriptions]
+    # Each distinct row is analyzed under the ID of its first occurrence, so a
+    # failure is logged against a real row
+    first_ids = {}
+    for key, row_id in zip(keys, row_ids):
+        first_ids.setdefault(key, row_id)
+    unique_rows = list(first_ids)
+    # Results arrive in first-occurrence order, i.e. exactly when a new row is reached
+    pending = zip(unique_rows, _map_rows(unique_rows, list(first_ids.values()), labels, chunksize))
+    
+    results = {}
+    for key, row_id in zip(keys, row_ids):
+        if key not in results:
+            unique_key, alerts = next(pending)
+            results[unique_key] = alerts
+        yield [(row_id,) + alert[1:] for alert in results[key]]
@@ -1,11 +1,14 @@
 import streamlit as st
 import pandas as pd
 import requests
-import re
 import time
+import hashlib
+import io
 import numpy as np
 import altair as alt
-from fuzzywuzzy import process as fw_process
+from concurrent.futures import ThreadPoolExecutor
+from urllib3.util.retry import Retry
+from ddi_analysis import is_external_db, collect_label_candidates, analyze_rows, ALERT_COLUMNS
 
 # --- CONFIGURATION ---
 st.set_page_config(
@@ -77,197 +80,102 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# --- DATABASE LOADING LOGIC ---
-def load_db_logic():
-    """Attempts to load external DB, falls back to Mock DB."""
+# --- FILE READERS ---
+# Resolved once per process: a failed import is not cached by Python, so a
+# missing optional reader would otherwise be searched for on every rerun.
+# CSV stays on pandas' C parser: Arrow's parser returns non-UTF-8 text as raw
+# bytes, drops duplicate headers and rejects ragged rows the C parser accepts.
+@st.cache_resource(show_spinner=False)
+def load_excel_engine():
+    """Picks calamine (Rust) for Excel when installed."""
     try:
-        import structured_drug_db
-        from structured_drug_db import get_drug_by_name
-        return True, get_drug_by_name
+        import python_calamine  # noqa: F401
+        return 'calamine'
     except ImportError:
-        # Simplified Fallback
-        return False, None
+        return None  # pandas' default (openpyxl)
 
-is_external_db, get_drug_func = load_db_logic()
+excel_engine = load_excel_engine()
 
-# --- HELPER FUNCTIONS ---
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_df(file_name, file_bytes):
+    """Parses an uploaded file once per content, so reruns skip re-reading it."""
+    buffer = io.BytesIO(file_bytes)
+    if file_name.endswith('.csv'):
+        return pd.read_csv(buffer)
+    return pd.read_excel(buffer, engine=excel_engine)
 
-def clean_drug_name(raw_name):
-    """
-    Cleans a raw drug string, maps it to a canonical name, and filters out equipment.
-    UPDATED logic to handle ANS, dosage forms, and special characters.
-    """
-    if not isinstance(raw_name, str) or not raw_name.strip(): return None
-        
-    cleaned_name = raw_name.strip().upper()
-    
-    # 1. Handle Multiline (Racikan)
-    if '\n' in cleaned_name:
-        cleaned_name = cleaned_name.split('\n')[0]
-
-    # 2. Aggressive cleaning to isolate the base product name
-    cleaned_name = re.sub(r'\s*\d+/\d+', '', cleaned_name) 
-    cleaned_name = re.sub(r':[\d\.]+', '', cleaned_name)
-    cleaned_name = re.sub(r'^\s*\d+/\d+\s+', '', cleaned_name)
-    cleaned_name = re.sub(r'[#]+', '', cleaned_name) 
-    
-    # Remove specific noise words
-    cleaned_name = re.sub(r'\b(SYR|TAB|SACHET|TABLET|KAPSUL|INJEKSI|MG|ML|CC|\*|ANS|DROPS|M\.F\.|PULV|DTD|NO\.)\b', '', cleaned_name, flags=re.IGNORECASE).strip()
-    
-    # Remove trailing numbers/dosages (e.g., "10" or "0.5")
-    cleaned_name = re.sub(r'\b\d{1,3}(?:\.\d+)?\b', '', cleaned_name).strip() 
-    
-    # Collapse spaces
-    cleaned_name = re.sub(r'\s+', ' ', cleaned_name).strip()
-    
-    return cleaned_name
+# --- ROBUST FDA CHECKER ---
+# Lookups that failed transiently are skipped for this long instead of paying
+# the HTTP timeout again for every rerun.
+FAILED_LOOKUP_TTL = 300
+# Cached labels are refetched after this long so label and safety updates are picked up
+LABEL_TTL = 7200
 
-def parse_time_slots(prescription_str):
-    s = prescription_str.lower()
-    slots = set()
-    freq = 1
-    
-    # Regex for "3 dd" or "3x"
-    if re.search(r'3\s*(dd|x)', s): freq = 3
-    elif re.search(r'2\s*(dd|x)', s): freq = 2
-    elif re.search(r'4\s*(dd|x)', s): freq = 4
-    elif re.search(r'1\s*(dd|x)', s): freq = 1
-    
-    if 'malam' in s or 'night' in s: slots.add('Night')
-    if 'pagi' in s or 'morning' in s: slots.add('Morning')
-    if 'siang' in s or 'noon' in s: slots.add('Noon')
-    if 'sore' in s: slots.add('Night') 
+@st.cache_resource(show_spinner=False)
+def get_http_session(pool_size=16):
+    """Shared keep-alive session so label fetches reuse TCP/TLS connections."""
+    session = requests.Session()
+    # Rate limiting (429) and server hiccups are retried with backoff; 404 is a real miss
+    retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503])
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    session.mount('https://', adapter)
+    return session
 
-    if not slots:
-        if freq >= 1: slots.add('Morning')
-        if freq >= 2: slots.add('Night')
-        if freq >= 3: slots.add('Noon')
-            
-    return list(slots)
+@st.cache_resource(show_spinner=False)
+def get_failed_lookups():
+    """Process-wide {drug: time of last transient failure}."""
+    return {}
 
-def determine_severity(text):
-    """Parses FDA warning text to determine severity level."""
-    t = text.lower()
-    high_keywords = [
-        'contraindicated', 'avoid', 'fatal', 'life-threatening', 'severe', 'serious', 
-        'do not use', 'unsafe', 'anaphylaxis', 'hypoglycemia', 'hospitalization', 'death',
-        'toxicity', 'major interaction'
-    ]
-    if any(x in t for x in high_keywords):
-        return 'High'
-        
-    moderate_keywords = [
-        'monitor', 'caution', 'risk', 'adjust', 'potential', 'care', 'consider',
-        'may increase', 'may decrease', 'alter', 'effect'
-    ]
-    if any(x in t for x in moderate_keywords):
-        return 'Moderate'
-    return 'Low'
-
-# --- ROBUST FDA CHECKER ---
-@st.cache_data(ttl=7200)
-def get_drug_label_text(drug_name):
+# Persisted to disk so labels survive app restarts and are shared across sessions.
+# Streamlit ignores TTL for disk-persisted caches, so expiry is enforced through the
+# ttl_bucket key argument (entries from past buckets age out via max_entries), and
+# transient HTTP failures raise instead of returning "" -- exceptions are never
+# cached and get retried next run.
+@st.cache_data(persist="disk", max_entries=5000, show_spinner=False)
+def _fetch_drug_label_text(drug_name, ttl_bucket):
     """Fetches full label text (Warnings, Interactions, Contraindications, Boxed Warning) for a drug."""
     base_url = "https://api.fda.gov/drug/label.json"
     params = {'search': f'openfda.substance_name:"{drug_name}"', 'limit': 1}
     
+    resp = get_http_session().get(base_url, params=params, timeout=5)
+    if resp.status_code == 404:
+        # openFDA answers 404 when no label matches: a definitive (cacheable) miss
+        return ""
+    resp.raise_for_status()
+    data = resp.json()
+    if 'results' not in data:
+        return ""
+    res = data['results'][0]
+    full_text = ""
+    fields = [
+        'drug_interactions', 'warnings', 'precautions', 
+        'contraindications', 'boxed_warning', 'warnings_and_cautions'
+    ]
+    for f in fields:
+        if f in res and isinstance(res[f], list):
+            full_text += " ".join(res[f]) + " "
+    return full_text
+
+def get_drug_label_text(drug_name):
+    """Returns the cached FDA label text for a drug, or "" if unavailable."""
+    # openFDA matches names case-insensitively; one cache entry per spelling
+    drug_name = drug_name.strip().upper()
+    failed = get_failed_lookups()
+    failed_at = failed.get(drug_name)
+    if failed_at is not None and time.monotonic() - failed_at < FAILED_LOOKUP_TTL:
+        return ""
     try:
-        resp = requests.get(base_url, params=params, timeout=5)
-        if resp.status_code == 200:
-            data = resp.json()
-            if 'results' in data:
-                res = data['results'][0]
-                full_text = ""
-                fields = [
-                    'drug_interactions', 'warnings', 'precautions', 
-                    'contraindications', 'boxed_warning', 'warnings_and_cautions'
-                ]
-                for f in fields:
-                    if f in res and isinstance(res[f], list):
-                        full_text += " ".join(res[f]) + " "
-                return full_text
+        # Wall-clock (not monotonic) so the bucket stays valid across restarts
+        return _fetch_drug_label_text(drug_name, int(time.time() // LABEL_TTL))
     except Exception:
+        failed[drug_name] = time.monotonic()
         return ""
-    return ""
-
-def check_fda_interaction_robust(drug_a, drug_b):
-    """Checks interaction by scanning full label text of A for B, and B for A."""
-    def scan(source, target, text):
-        if not text: return None, None
-        # Allow partial matches (e.g. "NSAID" matching "NSAIDs")
-        pattern = r'\b' + re.escape(target) + r'[a-z]*\b' 
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            start = max(0, match.start() - 200)
-            end = min(len(text), match.end() + 200)
-            snippet = "..." + text[start:end] + "..."
-            return True, snippet
-        return False, None
-
-    # Check A -> B
-    text_a = get_drug_label_text(drug_a)
-    found, desc = scan(drug_a, drug_b, text_a)
-    if found: return True, desc
-
-    # Check B -> A (Reverse)
-    text_b = get_drug_label_text(drug_b)
-    found, desc = scan(drug_b, drug_a, text_b)
-    if found: return True, desc
-            
-    return False, None
 
-def analyze_row(row_str, row_id):
-    if not isinstance(row_str, str): return []
-    
-    # Updated: Handle both delimiters (Old ; and New |||)
-    row_str = row_str.replace('|||', ';').replace('\n', ';')
-    items = row_str.split(';')
-    
-    time_buckets = {'Morning': [], 'Noon': [], 'Night': []}
-    
-    for item in items:
-        if not item.strip(): continue
-        clean_name = clean_drug_name(item)
-        
-        try:
-            drug_obj = get_drug_func(clean_name) if get_drug_func else None
-            if drug_obj:
-                raw_contents = getattr(drug_obj, 'contents', [])
-                ingredients_list = []
-                if isinstance(raw_contents, str):
-                    ingredients_list = [x.strip() for x in raw_contents.split(',')]
-                elif isinstance(raw_contents, list):
-                    ingredients_list = raw_contents
-                else:
-                    ingredients_list = getattr(drug_obj, 'active_ingredients', [])
-
-                if ingredients_list:
-                    slots = parse_time_slots(item)
-                    for slot in slots:
-                        for ingredient in ingredients_list:
-                            clean_ing = ingredient.strip()
-                            if clean_ing: time_buckets[slot].append(clean_ing)
-        except Exception: continue
-
-    alerts = []
-    for slot, ingredients in time_buckets.items():
-        if len(ingredients) < 2: continue
-        unique_ingredients = list(set(ingredients))
-        for i in range(len(unique_ingredients)):
-            for j in range(i + 1, len(unique_ingredients)):
-                ing_a = unique_ingredients[i]
-                ing_b = unique_ingredients[j]
-                has_interaction, desc = check_fda_interaction_robust(ing_a, ing_b)
-                if has_interaction:
-                    severity = determine_severity(desc)
-                    alerts.append({
-                        'Prescription ID': row_id,
-                        'Time Slot': slot,
-                        'Drug Pair': f"{ing_a} + {ing_b}",
-                        'Warning': desc,
-                        'Severity': severity
-                    })
-    return alerts
+def prefetch_drug_labels(drug_names, max_workers=16):
+    """Fetches labels for all drugs concurrently (HTTP-bound, so threads overlap) as {drug: text}."""
+    drug_names = list(drug_names)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(drug_names, executor.map(get_drug_label_text, drug_names)))
 
 # --- MAIN UI ---
 
@@ -307,21 +215,13 @@ if uploaded_file:
     # Load Data
     with st.spinner('Parsing file structure...'):
         try:
-            if uploaded_file.name.endswith('.csv'):
-                df = pd.read_csv(uploaded_file)
-            else:
-                df = pd.read_excel(uploaded_file)
+            df = load_df(uploaded_file.name, uploaded_file.getvalue())
         except Exception as e:
             st.error(f"Error reading file: {e}")
             st.stop()
             
-    # Column Discovery
-    cols = df.columns.str.lower()
-    resep_col = None
-    possible_cols = [c for c in cols if 'resep' in c]
-    if possible_cols:
-        target_col_name = df.columns[list(cols).index(possible_cols[0])]
-        resep_col = target_col_name
+    # Column Discovery: first column whose name contains 'resep' (any case)
+    resep_col = next((c for c in df.columns if 'resep' in str(c).lower()), None)
     
     if not resep_col:
         st.error("❌ Column 'resep' not found. Please ensure your file contains the prescription column.")
@@ -338,6 +238,10 @@ if uploaded_file:
             st.write("") # Spacing
             start_btn = st.button("🚀 Start Analysis", type="primary", use_container_width=True)
 
+        # Results are kept in the session for this exact file and column, so widget
+        # reruns (e.g. the log search box) keep showing them without re-analysis
+        analysis_key = (hashlib.sha256(uploaded_file.getvalue()).hexdigest(), resep_col)
+
         if start_btn:
             all_alerts = []
             
@@ -351,32 +255,46 @@ if uploaded_file:
             rows_to_process = df
             total_rows = len(rows_to_process)
             
+            # Plain arrays instead of iterrows(), which builds a Series per row
+            prescriptions = rows_to_process[resep_col].astype(str).to_numpy()
+            if 'No' in rows_to_process.columns:
+                row_ids = rows_to_process['No'].to_numpy()
+            elif 'ID' in rows_to_process.columns:
+                row_ids = rows_to_process['ID'].to_numpy()
+            else:
+                row_ids = np.arange(1, total_rows + 1)
+            
+            # Fetch every FDA label the analysis will need up front, concurrently
+            status_text.markdown("<span style='color:#64748b'>Fetching FDA labels...</span>", unsafe_allow_html=True)
+            labels = prefetch_drug_labels(collect_label_candidates(prescriptions))
+            
             # Processing Loop
-            for index, row in rows_to_process.iterrows():
-                row_str = str(row[resep_col])
-                row_id = row.get('No', row.get('ID', index + 1))
-                
-                try:
-                    alerts = analyze_row(row_str, row_id)
-                    all_alerts.extend(alerts)
-                except Exception as e:
-                    print(f"Row {index} failed: {e}")
+            # Every progress update is a message to the browser: send ~100 at most
+            progress_step = max(1, total_rows // 100)
+            for index, alerts in enumerate(analyze_rows(prescriptions, row_ids, labels)):
+                all_alerts.extend(alerts)
                 
                 # Update Progress
-                pct = (index + 1) / total_rows
-                p_bar.progress(min(pct, 1.0))
-                status_text.markdown(f"<span style='color:#64748b'>Processing prescription <b>{index + 1}</b> of <b>{total_rows}</b>...</span>", unsafe_allow_html=True)
-                time.sleep(0.01) 
+                if index % progress_step == 0 or index == total_rows - 1:
+                    pct = (index + 1) / total_rows
+                    p_bar.progress(min(pct, 1.0))
+                    status_text.markdown(f"<span style='color:#64748b'>Processing prescription <b>{index + 1}</b> of <b>{total_rows}</b>...</span>", unsafe_allow_html=True)
                 
             # Cleanup Progress
             p_bar.empty()
             status_text.empty()
             
+            st.session_state['ddi_results'] = (analysis_key, all_alerts)
+
+        saved_results = st.session_state.get('ddi_results')
+        if saved_results and saved_results[0] == analysis_key:
+            all_alerts = saved_results[1]
+            
             # --- RESULTS DASHBOARD ---
             st.markdown("### Analysis Report")
             
             if all_alerts:
-                results_df = pd.DataFrame(all_alerts)
+                results_df = pd.DataFrame.from_records(all_alerts, columns=ALERT_COLUMNS)
                 
                 # Metrics Prep
                 total_rx = len(df)
@@ -445,10 +363,23 @@ if uploaded_file:
                     with c3:
                         st.markdown("##### 📉 DDIs per Prescription (Burden)")
                         # BURDEN DISTRIBUTION
-                        burden_counts = results_df['Prescription ID'].value_counts()
                         # Get all IDs including zeros
                         all_ids = df['No'] if 'No' in df.columns else df.index
-                        full_burden = burden_counts.reindex(all_ids, fill_value=0)
+                        ids_arr = results_df['Prescription ID'].to_numpy()
+                        all_ids_arr = np.asarray(all_ids)
+                        if (
+                            np.issubdtype(ids_arr.dtype, np.integer)
+                            and np.issubdtype(all_ids_arr.dtype, np.integer)
+                            and len(all_ids_arr) > 0
+                            and min(ids_arr.min(), all_ids_arr.min()) >= 0
+                            and max(ids_arr.max(), all_ids_arr.max()) <= 10 * len(all_ids_arr) + 1000
+                        ):
+                            # Dense non-negative integer IDs: one C-level histogram pass
+                            counts = np.bincount(ids_arr, minlength=int(all_ids_arr.max()) + 1)
+                            full_burden = pd.Series(counts[all_ids_arr], index=all_ids)
+                        else:
+                            burden_counts = results_df['Prescription ID'].value_counts()
+                            full_burden = burden_counts.reindex(all_ids, fill_value=0)
                         
                         # STATISTICS CALCULATIONS
                         avg_ddi = full_burden.mean()
@@ -500,9 +431,12 @@ if uploaded_file:
                     search_term = st.text_input("🔍 Filter by Drug, ID or Keyword", "", placeholder="Type 'Aspirin' or '123'...")
                     
                     if search_term:
-                        filtered_df = results_df[
-                            results_df.apply(lambda row: row.astype(str).str.contains(search_term, case=False).any(), axis=1)
-                        ]
+                        # Column-wise vectorized OR instead of a Python-level apply per row;
+                        # plain substring match (regex=False) so typed text is taken literally
+                        mask = pd.Series(False, index=results_df.index)
+                        for col in results_df.columns:
+                            mask |= results_df[col].astype(str).str.contains(search_term, case=False, regex=False, na=False)
+                        filtered_df = results_df[mask]
                     else:
                         filtered_df = results_df
                         
@@ -532,7 +466,8 @@ if uploaded_file:
                         )
             else:
                 st.success("✅ **Analysis Complete:** No significant interactions detected in this dataset.")
-                st.balloons()
+                if start_btn:
+                    st.balloons()
 else:
     # Empty State (HTML5 Style)
     st.markdown("""
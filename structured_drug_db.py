@@ -1,7 +1,21 @@
 # --- Efficient and Structured Drug Database for NER System ---
 
+import os
+import re
+import difflib
 from collections import namedtuple
-from fuzzywuzzy import process
+import numpy as np
+
+try:
+    from rapidfuzz import process, fuzz, utils
+    _normalize_name = utils.default_process
+except ImportError:
+    # Fall back to the (slower) standard library matcher
+    process = fuzz = None
+
+    def _normalize_name(name):
+        """Same normalization as rapidfuzz.utils.default_process."""
+        return ''.join(c if c.isalnum() else ' ' for c in name).lower().strip()
 
 # Define structured data types for both drugs and equipment
 Drug = namedtuple('Drug', ['name', 'generic', 'contents'])
@@ -54965,6 +54979,34 @@ for drug in DRUGS:
 
 EQUIPMENT_BY_NAME = {eq.name.lower(): eq for eq in EQUIPMENT}
 
+# Fuzzy-match candidates built once: (keys, normalized keys)
+def _fuzzy_choices(db_dict):
+    keys = list(db_dict)
+    return keys, [_normalize_name(key) for key in keys]
+
+DRUG_CHOICES = _fuzzy_choices(DRUG_BY_NAME)
+EQUIPMENT_CHOICES = _fuzzy_choices(EQUIPMENT_BY_NAME)
+
+# Words that may trail a known name without naming a different product:
+# dose numbers, units and schedule shorthand ("500", "mg", "2x1", "dd", "pagi")
+_RESIDUE_WORDS = frozenset({
+    'mg', 'ml', 'mcg', 'cc', 'iu', 'dd', 'x', 'prn',
+    'pagi', 'siang', 'sore', 'malam', 'morning', 'noon', 'night'
+})
+_RE_RESIDUE_NUMBER = re.compile(
+    r'\d+(?:[.,]\d+)?(?:mg|ml|mcg|g|cc|iu)?'  # doses: "500", "0,5", "500mg"
+    r'|\d+(?:[-/]\d+)+'                     # "1-0-0", "1/2"
+    r'|\d+x\d*|x\d+'                         # frequencies: "2x1", "3x", "x1"
+)
+
+def _is_residue_word(word):
+    """True for a trailing word that is only dose/unit/schedule residue."""
+    word = word.strip('.,;:()[]*')
+    return not word or word in _RESIDUE_WORDS or _RE_RESIDUE_NUMBER.fullmatch(word) is not None
+
+# Fuzzy drug-name matches already computed: lowercased name -> DRUG_BY_NAME key (or None)
+_DRUG_FUZZY_MATCHES = {}
+
 # Query functions
 
 def get_drug_by_name(name):
@@ -54974,13 +55016,44 @@ def get_drug_by_name(name):
     if exact_match:
         return exact_match
     
+    # Then the longest known name the text starts with (e.g. 'Amoxan 500 Forte')
+    prefix_key = _prefix_match_name(name, DRUG_BY_NAME)
+    if prefix_key:
+        return DRUG_BY_NAME[prefix_key]
+    
     # Use fuzzy match for slightly misformatted names
-    from fuzzywuzzy import process
-    best_match_key = _fuzzy_match_name(name, DRUG_BY_NAME)
+    if name.lower() not in _DRUG_FUZZY_MATCHES:
+        _DRUG_FUZZY_MATCHES[name.lower()] = _fuzzy_match_name(name, DRUG_CHOICES)
+    best_match_key = _DRUG_FUZZY_MATCHES[name.lower()]
     if best_match_key:
         return DRUG_BY_NAME[best_match_key]
     return None
 
+def prime_drug_matches(names, threshold=80, block_size=128):
+    """
+    Fuzzy-matches many drug names in one batched, multi-threaded pass so that
+    later get_drug_by_name calls for them skip the per-name scan. Does nothing
+    on a single core, where per-name matching prunes candidates better.
+    """
+    if process is None or (os.cpu_count() or 1) < 2:
+        return
+    pending = [
+        key for key in dict.fromkeys(name.lower() for name in names if name)
+        if key not in DRUG_BY_NAME and key not in _DRUG_FUZZY_MATCHES
+        and not _prefix_match_name(key, DRUG_BY_NAME)
+    ]
+    keys, processed = DRUG_CHOICES
+    # Blocks bound the score matrix to block_size x len(keys) floats
+    for start in range(0, len(pending), block_size):
+        block = pending[start:start + block_size]
+        scores = process.cdist(
+            [_normalize_name(key) for key in block], processed,
+            scorer=fuzz.WRatio, score_cutoff=threshold, dtype=np.float32, workers=-1
+        )
+        for key, row in zip(block, scores):
+            best = row.argmax()
+            _DRUG_FUZZY_MATCHES[key] = keys[best] if row[best] >= threshold else None
+
 def get_equipment_by_name(name):
     """Return the Equipment object for a given name, or None if not found."""
     # First try exact match
@@ -54989,25 +55062,48 @@ def get_equipment_by_name(name):
         return exact_match
     
     # Use fuzzy match
-    from fuzzywuzzy import process
-    best_match_key = _fuzzy_match_name(name, EQUIPMENT_BY_NAME)
+    best_match_key = _fuzzy_match_name(name, EQUIPMENT_CHOICES)
     if best_match_key:
         return EQUIPMENT_BY_NAME[best_match_key]
     return None
 
-def _fuzzy_match_name(name, db_dict, threshold=80):
+def _prefix_match_name(name, db_dict):
+    """
+    Helper function to find the longest dictionary key made of the leading words
+    of name, when every dropped trailing word is residue (see _is_residue_word).
+    A dropped real word ('care one crisp cleax' -> 'care') is left to fuzzy matching.
+    """
+    words = name.lower().split()
+    for end in range(len(words) - 1, 0, -1):
+        if not _is_residue_word(words[end]):
+            return None
+        key = ' '.join(words[:end])
+        if key in db_dict:
+            return key
+    return None
+
+def _fuzzy_match_name(name, choices, threshold=80):
     """
-    Helper function to find the best fuzzy match key in a dictionary.
-    Assumes fuzzywuzzy is imported.
+    Helper function to find the best fuzzy match key among precomputed choices
+    (see _fuzzy_choices).
     """
-    if not name or not db_dict:
+    keys, processed = choices
+    if not name or not keys:
         return None
     
-    # Process the name against all keys in the dictionary
-    best_match = process.extractOne(name, db_dict.keys())
+    if process is None:
+        close = difflib.get_close_matches(_normalize_name(name), processed, n=1, cutoff=threshold / 100)
+        return keys[processed.index(close[0])] if close else None
+    
+    # Only the query needs normalizing; candidates scoring below the threshold
+    # are pruned early instead of being fully scored
+    best_match = process.extractOne(
+        _normalize_name(name), processed,
+        scorer=fuzz.WRatio, score_cutoff=threshold
+    )
     
-    if best_match and best_match[1] >= threshold:
-        return best_match[0]
+    if best_match:
+        return keys[best_match[2]]
     return None
 
 def get_drugs_by_generic(generic):
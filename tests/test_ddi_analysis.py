@@ -0,0 +1,50 @@
+import pytest
+
+import ddi_analysis
+from ddi_analysis import clean_drug_name, find_mentions, _interacting_pairs, analyze_rows
+
+
+def test_find_mentions_reports_names_contained_in_longer_names():
+    text = 'Avoid use with insulin glargine.'
+    found = find_mentions(text, ('Insulin', 'Insulin Glargine'))
+    assert set(found) == {'Insulin', 'Insulin Glargine'}
+
+
+def test_find_mentions_reports_overlapping_suffix_names():
+    assert set(find_mentions('Contains folic acid.', ('Folic Acid', 'Acid'))) == {'Folic Acid', 'Acid'}
+    assert set(find_mentions('Do not mix with isopropyl alcohol.', ('Isopropyl Alcohol', 'Alcohol'))) == {
+        'Isopropyl Alcohol', 'Alcohol'
+    }
+
+
+def test_find_mentions_snippet_is_taken_at_first_mention():
+    text = 'Avoid insulin glargine. ' + 'x' * 500 + ' Monitor insulin dosing.'
+    found = find_mentions(text, ('Insulin', 'Insulin Glargine'))
+    assert 'Avoid insulin glargine' in found['Insulin']
+
+
+def test_interacting_pairs_flags_both_overlapping_names():
+    labels = {'Metformin': 'Use caution with insulin glargine.'}
+    pairs = {pair for pair, _, _ in _interacting_pairs(('Insulin', 'Insulin Glargine', 'Metformin'), labels)}
+    assert pairs == {'Insulin + Metformin', 'Insulin Glargine + Metformin'}
+
+
+def test_failed_rows_are_logged_with_their_first_row_id(monkeypatch, capsys):
+    def fail(row_str, row_id, labels):
+        raise ValueError('bad row')
+
+    monkeypatch.setattr(ddi_analysis, 'analyze_row', fail)
+    results = list(analyze_rows(['A 3x1;B 3x1', 'C 1x1', 'A 3x1;B 3x1'], [11, 12, 13], {}))
+    assert results == [[], [], []]
+    assert capsys.readouterr().out.splitlines() == ['Row 11 failed: bad row', 'Row 12 failed: bad row']
+
+
+@pytest.mark.parametrize('raw, cleaned', [
+    ('AMBROXOL 30 MG TAB.', 'AMBROXOL'),
+    ('AMOXICILLIN 500 MG/5ML', 'AMOXICILLIN'),
+    ('PARACETAMOL (500)', 'PARACETAMOL'),
+    ('VITAMIN D-45', 'VITAMIN D-45'),
+    ('CTM (SANBE)', 'CTM (SANBE)'),
+])
+def test_clean_drug_name_drops_dose_noise_only(raw, cleaned):
+    assert clean_drug_name(raw) == cleaned
@@ -0,0 +1,33 @@
+import pytest
+
+import structured_drug_db
+from structured_drug_db import get_drug_by_name, _prefix_match_name, DRUG_BY_NAME
+
+
+@pytest.mark.parametrize('name, key', [
+    ('simvastatin 3x1', 'simvastatin'),
+    ('Simvastatin 3X1', 'simvastatin'),
+    ('paracetamol dd pagi', 'paracetamol'),
+    ('amoxan 500 3x1', 'amoxan 500'),
+])
+def test_prefix_match_drops_dose_and_schedule_residue(name, key):
+    assert _prefix_match_name(name, DRUG_BY_NAME) == key
+    assert get_drug_by_name(name) is DRUG_BY_NAME[key]
+
+
+def test_prefix_match_does_not_drop_real_words():
+    assert _prefix_match_name('care one crisp cleax', DRUG_BY_NAME) is None
+    assert get_drug_by_name('care one crisp cleax') is not DRUG_BY_NAME['care']
+
+
+def test_name_without_residue_falls_through_to_fuzzy_match(monkeypatch):
+    calls = []
+
+    def fuzzy(name, choices, threshold=80):
+        calls.append(name)
+        return 'care one crisp clean'
+
+    monkeypatch.setattr(structured_drug_db, '_fuzzy_match_name', fuzzy)
+    monkeypatch.setattr(structured_drug_db, '_DRUG_FUZZY_MATCHES', {})
+    assert get_drug_by_name('care one crisp cleax') is DRUG_BY_NAME['care one crisp clean']
+    assert calls == ['care one crisp cleax']